@@ -1,13 +1,41 @@
 # Importar las bibliotecas
 import os
+import asyncio
+import functools
+import itertools
+import json
 import logging
+import pickle
+import queue
+import socket
+import threading
 import time
-import pandas as pd
+import warnings
+from collections import deque
+import numpy as np
+from binance import AsyncClient, ThreadedWebsocketManager
 from binance.client import Client
 from binance.enums import *
-from ta.trend import SMAIndicator
-from ta.momentum import RSIIndicator
-from ta.volatility import AverageTrueRange, BollingerBands
+from binance.exceptions import BinanceAPIException
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+try:
+    import redis
+except ImportError:  # La caché es opcional
+    redis = None
+
+# Las funciones con firma explícita se compilan al importar el módulo y se guardan en disco
+# (cache=True), así los siguientes arranques no pagan la compilación JIT.
+try:
+    from numba import njit, prange
+except ImportError:  # Sin numba las funciones se ejecutan en Python puro
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 # Configuración de logging
 logging.basicConfig(filename='bot.log', level=logging.INFO, 
@@ -18,10 +46,33 @@ logging.basicConfig(filename='bot.log', level=logging.INFO,
 os.environ['BINANCE_API_KEY'] = "d66UiUnEAHK4OyTLFjcmhiBJsqghBqKduIWNd1FQhJ7d6Pg8j9ChgBMQbUWyOn0k"
 os.environ['BINANCE_API_SECRET'] = "Jex07zHk2Q5ZWpmJPKdbEcSA9S6lQ13U1tfytGFnnlMYni19TqGzqOZDjTTwOYff"
 
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    Adaptador HTTP que reutiliza las conexiones TCP/TLS con Binance (keep-alive y TCP_NODELAY).
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        # Las opciones por defecto de urllib3 ya activan TCP_NODELAY
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+
 # Conectar con la API de Binance usando variables de entorno
+# La latencia de cada llamada depende sobre todo de la red: para operar en vivo conviene
+# ejecutar el bot en una instancia cercana a los servidores de Binance (AWS ap-northeast-1, Tokio).
 api_key = os.getenv('BINANCE_API_KEY')
 api_secret = os.getenv('BINANCE_API_SECRET')
 client = Client(api_key, api_secret)
+client.session.headers.update({'Connection': 'keep-alive'})
+client.session.mount('https://', KeepAliveAdapter(pool_maxsize=20))
+
+# Repartir las llamadas entre los endpoints alternativos de la API (api1/api2/api3.binance.com)
+API_ENDPOINTS = [Client.API_URL.format(endpoint, 'com') for endpoint in
+                 (Client.BASE_ENDPOINT_1, Client.BASE_ENDPOINT_2, Client.BASE_ENDPOINT_3)]
+api_endpoints = itertools.cycle(API_ENDPOINTS)
+
+# Conectar con Redis para cachear respuestas de la API (opcional)
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+redis_client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1, socket_timeout=1) if redis else None
+redis_retry_at = 0  # Hora a partir de la cual se vuelve a usar la caché tras un error de conexión
 
 # Parámetros de la estrategia
 SMA_SHORT = 50  # Media móvil rápida
@@ -33,6 +84,117 @@ MIN_VOLUME = 1000000  # Volumen mínimo para analizar un activo (en USDT)
 MIN_VOLATILITY = 0.02  # Volatilidad mínima para filtrar activos
 RSI_THRESHOLD_BUY = 30  # RSI para compra (sobreventa)
 RSI_THRESHOLD_SELL = 70  # RSI para venta (sobrecompra)
+MAX_CONCURRENT_REQUESTS = 20  # Peticiones simultáneas a la API (límite de tasa)
+EXCHANGE_INFO_CACHE_TTL = 3600  # Información del exchange (1h)
+REDIS_RETRY_DELAY = 300  # Segundos sin usar la caché tras un error de conexión con Redis
+STEP_SIZES_REFRESH = 86400  # Actualizar los tamaños de paso una vez al día
+REQUEST_WEIGHT_PER_MINUTE = 1100  # Peso de peticiones por minuto (margen bajo el límite de Binance)
+RATE_LIMIT_HEADROOM = 0.9  # Fracción del límite REQUEST_WEIGHT de exchangeInfo que se usa
+CYCLE_INTERVAL = 14400  # Tiempo máximo entre ciclos de la estrategia (4 horas)
+STOP_LOSS_CHECK_INTERVAL = 10  # Segundos entre comprobaciones del stop-loss con precios en streaming
+STREAM_MAX_AGE = 3 * STOP_LOSS_CHECK_INTERVAL  # Antigüedad máxima de un dato de websocket para usarlo
+STREAM_WARMUP = 300  # Segundos de stream de tickers antes de fiarse de sus volúmenes
+
+# Peso de cada llamada a la API (el resto pesa 1)
+API_WEIGHTS = {
+    'get_ticker': 80,  # Ticker de 24h de todos los símbolos
+    'get_exchange_info': 20,
+    'get_account': 20,
+    'get_my_trades': 20,
+    'get_klines': 2,
+    'get_symbol_ticker': 2,
+}
+
+# Tamaño de paso (filtro LOT_SIZE) de cada símbolo
+STEP_SIZES = {}
+step_sizes_updated = 0
+
+# Saldos libres de la cuenta por activo, actualizados una vez por ciclo y tras cada orden
+balances = {}
+
+# Posiciones abiertas por símbolo (cantidad, precio de compra y hora), con copia en Redis
+positions = {}
+POSITIONS_KEY = 'positions'
+
+# Datos recibidos por websocket: último precio, volumen en USDT de 24h y mejor bid de cada símbolo,
+# guardados como (valor, hora local de recepción en segundos)
+last_prices = {}
+ticker_volumes = {}
+best_bids = {}
+miniticker_started = None  # Hora de arranque del stream de tickers
+# Símbolos con una vela diaria recién cerrada
+closed_klines = queue.Queue()
+
+# Sumas de las medias móviles por símbolo, persistentes entre ciclos
+sma_state = {}
+
+class TokenBucket:
+    """
+    Limitador de peticiones por peso (token bucket) para no superar el límite de la API.
+    """
+    def __init__(self, capacity, refill_per_sec):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def configure(self, capacity, refill_per_sec):
+        with self.lock:
+            self.capacity = capacity
+            self.refill_per_sec = refill_per_sec
+            self.tokens = min(self.tokens, capacity)
+
+    def block_for(self, seconds):
+        """
+        Pausar a todos los que esperan tokens durante `seconds` segundos (p. ej. tras un 429 de Binance).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_sec)
+            self.tokens = min(self.tokens, -seconds * self.refill_per_sec)
+            self.updated = now
+
+    def _reserve(self, weight):
+        """
+        Reservar `weight` tokens y devolver los segundos que hay que esperar para usarlos.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_sec)
+            self.updated = now
+            self.tokens -= weight
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.refill_per_sec
+
+    def acquire(self, weight=1):
+        delay = self._reserve(weight)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, weight=1):
+        delay = self._reserve(weight)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+rate_limiter = TokenBucket(REQUEST_WEIGHT_PER_MINUTE, REQUEST_WEIGHT_PER_MINUTE / 60)
+
+def update_rate_limits(exchange_info):
+    """
+    Ajustar el limitador al límite REQUEST_WEIGHT por minuto publicado en exchangeInfo.
+    """
+    for limit in exchange_info.get('rateLimits', []):
+        if limit['rateLimitType'] == 'REQUEST_WEIGHT' and limit['interval'] == 'MINUTE':
+            capacity = limit['limit'] * RATE_LIMIT_HEADROOM / limit['intervalNum']
+            rate_limiter.configure(capacity, capacity / 60)
+            return
+
+def get_retry_after(e):
+    """
+    Segundos de espera indicados por Binance (cabecera Retry-After) tras un 429 o un 418.
+    """
+    if isinstance(e, BinanceAPIException) and e.status_code in (418, 429):
+        return int(e.response.headers.get('Retry-After', 1))
+    return None
 
 def safe_api_call(call, *args, max_retries=5, delay=60, **kwargs):
     """
@@ -41,161 +203,882 @@ def safe_api_call(call, *args, max_retries=5, delay=60, **kwargs):
     retries = 0
     while retries < max_retries:
         try:
+            rate_limiter.acquire(API_WEIGHTS.get(call.__name__, 1))
+            rotate_api_endpoint(call)
             return call(*args, **kwargs)
         except Exception as e:
-            logging.error(f"Error en la API: {e}. Reintentando en {delay} segundos...")
+            wait = get_retry_after(e)
+            if wait is not None:
+                rate_limiter.block_for(wait)  # El resto de llamadas también esperan el Retry-After
+            else:
+                wait = delay
+            logging.error(f"Error en la API: {e}. Reintentando en {wait} segundos...")
             retries += 1
-            time.sleep(delay)
+            time.sleep(wait)
     raise Exception(f"Error persistente después de {max_retries} intentos.")
 
+def rotate_api_endpoint(call):
+    """
+    Apuntar el cliente de la llamada al siguiente endpoint de la API (round-robin).
+    """
+    api_client = getattr(call, '__self__', None)
+    if hasattr(api_client, 'API_URL'):
+        api_client.API_URL = next(api_endpoints)
+
+def handle_redis_error(action, e):
+    """
+    Registrar un error de Redis. Si no se puede conectar, la caché se desactiva durante
+    REDIS_RETRY_DELAY segundos en lugar de bloquear cada llamada esperando al servidor.
+    """
+    global redis_retry_at
+    if isinstance(e, (redis.ConnectionError, redis.TimeoutError)):
+        logging.warning(f"Redis no disponible ({action}): {e}. "
+                        f"Se desactiva la caché durante {REDIS_RETRY_DELAY} segundos.")
+        redis_retry_at = time.time() + REDIS_RETRY_DELAY
+    else:
+        logging.warning(f"Error de Redis ({action}): {e}")
+
+def cache_available():
+    """
+    Indicar si se puede usar la caché (Redis configurado y sin errores de conexión recientes).
+    """
+    return redis_client is not None and time.time() >= redis_retry_at
+
+def cache_get(key):
+    """
+    Leer un valor de la caché de Redis. Devuelve None si no existe o si Redis no está disponible.
+    """
+    if not cache_available():
+        return None
+    try:
+        value = redis_client.get(key)
+    except redis.RedisError as e:
+        handle_redis_error(f"leyendo {key}", e)
+        return None
+    return pickle.loads(value) if value is not None else None
+
+def cache_set(key, value, ttl):
+    """
+    Guardar un valor en la caché de Redis con un tiempo de expiración en segundos.
+    """
+    if not cache_available():
+        return
+    try:
+        redis_client.set(key, pickle.dumps(value), ex=ttl)
+    except redis.RedisError as e:
+        handle_redis_error(f"escribiendo {key}", e)
+
+def redis_memoize(ttl, key):
+    """
+    Decorador que cachea en Redis el resultado de una función.
+    `key` recibe los mismos argumentos que la función y devuelve la clave de la caché.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            value = cache_get(cache_key)
+            if value is None:
+                value = func(*args, **kwargs)
+                cache_set(cache_key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+async def safe_api_call_async(call, *args, max_retries=5, delay=60, **kwargs):
+    """
+    Versión asíncrona de safe_api_call para las llamadas del AsyncClient.
+    """
+    retries = 0
+    while retries < max_retries:
+        try:
+            await rate_limiter.acquire_async(API_WEIGHTS.get(call.__name__, 1))
+            rotate_api_endpoint(call)
+            return await call(*args, **kwargs)
+        except Exception as e:
+            wait = get_retry_after(e)
+            if wait is not None:
+                rate_limiter.block_for(wait)  # El resto de llamadas también esperan el Retry-After
+            else:
+                wait = delay
+            logging.error(f"Error en la API: {e}. Reintentando en {wait} segundos...")
+            retries += 1
+            await asyncio.sleep(wait)
+    raise Exception(f"Error persistente después de {max_retries} intentos.")
+
+@redis_memoize(ttl=EXCHANGE_INFO_CACHE_TTL, key=lambda: "exchange_info")
+def get_exchange_info():
+    """
+    Obtener la información del exchange (símbolos y filtros).
+    """
+    return safe_api_call(client.get_exchange_info)
+
+def refresh_step_sizes(max_age=STEP_SIZES_REFRESH):
+    """
+    Indexar el tamaño de paso de todos los símbolos a partir de una sola llamada a la API.
+    Solo se vuelve a descargar si los datos tienen más de `max_age` segundos.
+    """
+    global step_sizes_updated
+    if STEP_SIZES and time.time() - step_sizes_updated < max_age:
+        return
+    exchange_info = get_exchange_info()
+    update_rate_limits(exchange_info)
+    STEP_SIZES.clear()
+    STEP_SIZES.update({s['symbol']: next(f['stepSize'] for f in s['filters'] if f['filterType'] == 'LOT_SIZE')
+                       for s in exchange_info['symbols']})
+    step_sizes_updated = time.time()
+
 def get_symbols():
     """
     Obtener todos los símbolos disponibles en Binance que operan con USDT y filtrar por volumen.
     """
-    exchange_info = safe_api_call(client.get_exchange_info)
+    exchange_info = get_exchange_info()
     symbols = [s['symbol'] for s in exchange_info['symbols'] if s['quoteAsset'] == 'USDT' and s['status'] == 'TRADING']
     return symbols
 
-def filter_symbols_by_volume(symbols, min_volume=MIN_VOLUME):
+def filter_symbols_by_volume(symbols, min_volume=MIN_VOLUME, volumes=None):
     """
     Filtrar los símbolos basados en el volumen diario.
+    Si no se pasan los volúmenes recibidos por websocket, se obtiene el ticker de 24h
+    de todos los símbolos en una sola llamada y se filtra localmente.
     """
-    filtered_symbols = []
-    for symbol in symbols:
-        tickers = safe_api_call(client.get_ticker, symbol=symbol)
-        volume = float(tickers['quoteVolume'])
-        if volume >= min_volume:
-            filtered_symbols.append(symbol)
-    return filtered_symbols
+    if volumes is None:
+        tickers = safe_api_call(client.get_ticker)
+        volumes = {t['symbol']: float(t['quoteVolume']) for t in tickers}
+    return [s for s in symbols if volumes.get(s, 0) >= min_volume]
 
-def filter_symbols_by_volatility(symbols, min_volatility=MIN_VOLATILITY):
+async def filter_and_fetch(async_client, symbols, semaphore, min_volatility=MIN_VOLATILITY, keep_symbols=()):
     """
     Filtrar los símbolos basados en la volatilidad histórica.
+    Las velas de todos los símbolos se descargan en paralelo y se devuelven los datos
+    de los símbolos filtrados, junto con sus cierres apilados (ver stack_closes),
+    para no tener que descargarlos de nuevo. Los símbolos de `keep_symbols` (posiciones
+    abiertas) se mantienen siempre para no dejar de vigilar su stop-loss.
     """
-    filtered_symbols = []
-    for symbol in symbols:
-        data = get_data(symbol)
-        data['price_change'] = data['close'].pct_change()
-        volatility = data['price_change'].std()
-        if volatility >= min_volatility:
-            filtered_symbols.append(symbol)
-    return filtered_symbols
+    datas = await get_data_many(async_client, symbols, semaphore)
+    closes = stack_closes(datas)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Símbolos sin suficientes velas
+        returns = np.diff(closes, axis=1) / closes[:, :-1]
+        volatilities = np.nanstd(returns, axis=1, ddof=1)
+    keep = (volatilities >= min_volatility) | np.isin(np.array(symbols, dtype=object), list(keep_symbols))
+    filtered = {symbol: data for symbol, data, k in zip(symbols, datas, keep) if k}
+    return filtered, closes[keep]
+
+def stack_closes(datas):
+    """
+    Apilar los cierres de varios símbolos en un array 2D (símbolos x velas) alineado por la última vela.
+    Los símbolos con menos velas se rellenan con NaN al principio.
+    """
+    n_bars = max((len(d['close']) for d in datas), default=0)
+    closes = np.full((len(datas), n_bars), np.nan)
+    for i, data in enumerate(datas):
+        if len(data['close']):
+            closes[i, n_bars - len(data['close']):] = data['close']
+    return closes
+
+async def bounded(coro, semaphore):
+    """
+    Ejecutar una corrutina limitando la concurrencia con un semáforo.
+    """
+    async with semaphore:
+        return await coro
 
-def get_data(symbol, limit=500):
+async def get_data_many(async_client, symbols, semaphore):
+    """
+    Descargar en paralelo los datos históricos de varios símbolos.
+    """
+    return await asyncio.gather(*(bounded(get_data_async(async_client, s), semaphore) for s in symbols))
+
+DAY_MS = 86400 * 1000
+
+def seconds_until_daily_close():
+    """
+    Segundos que faltan para el cierre de la vela diaria (00:00 UTC).
+    """
+    return int(86400 - time.time() % 86400) + 1
+
+def klines_cache_key(symbol, limit=500):
+    """
+    Clave de la caché de las velas diarias cerradas de un símbolo para el día UTC actual.
+    """
+    return f"klines:{symbol}:1d:{limit}:{int(time.time() // 86400)}"
+
+async def get_data_async(async_client, symbol, limit=500):
     """
     Obtener datos históricos de precios (velas) de Binance.
+    Las velas cerradas se cachean hasta el próximo cierre diario; si están en la caché solo se
+    descarga la vela en curso, y si no, una única descarga trae el histórico completo.
+    Las llamadas a Redis se hacen en un hilo aparte para no bloquear el resto de descargas.
+    Devuelve un diccionario de arrays de NumPy con las columnas que usa la estrategia.
     """
-    klines = safe_api_call(client.get_klines, symbol=symbol, interval=Client.KLINE_INTERVAL_1DAY, limit=limit)
-    data = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 
-                                         'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume', 
-                                         'taker_buy_quote_asset_volume', 'ignore'])
-    data['close'] = pd.to_numeric(data['close'])
-    return data
+    cache_key = klines_cache_key(symbol, limit)
+    closed = await asyncio.to_thread(cache_get, cache_key)
+    klines = None
+    if closed:
+        current = await safe_api_call_async(async_client.get_klines, symbol=symbol,
+                                            interval=AsyncClient.KLINE_INTERVAL_1DAY, limit=1)
+        # Si la caché no enlaza con la vela en curso (cambio de día) se descarga todo de nuevo
+        if current and closed[-1][0] + DAY_MS == current[0][0]:
+            klines = closed + current
+    if klines is None:
+        klines = await safe_api_call_async(async_client.get_klines, symbol=symbol,
+                                           interval=AsyncClient.KLINE_INTERVAL_1DAY, limit=limit)
+        # Sin la vela en curso
+        await asyncio.to_thread(cache_set, cache_key, klines[:-1], seconds_until_daily_close())
+    # Las columnas se leen directamente como float64 (una fila contigua por columna)
+    high, low, close = np.array([[k[2] for k in klines], [k[3] for k in klines], [k[4] for k in klines]],
+                                dtype=np.float64).reshape(3, -1)
+    return {
+        'ts': np.fromiter((k[0] for k in klines), dtype=np.int64, count=len(klines)),
+        'high': high,
+        'low': low,
+        'close': close,
+    }
 
-def apply_advanced_strategy(data):
+@njit('float64[:](float64[:], int64, int64)', cache=True)
+def _wilder_smooth(values, window, min_periods):
+    """
+    Media exponencial de Wilder (alpha = 1 / window), ignorando los NaN iniciales.
+    """
+    alpha = 1.0 / window
+    out = np.full(len(values), np.nan)
+    mean = np.nan
+    count = 0
+    for i in range(len(values)):
+        x = values[i]
+        if not np.isnan(x):
+            count += 1
+            mean = x if count == 1 else mean + alpha * (x - mean)
+        if count >= min_periods:
+            out[i] = mean
+    return out
+
+def sma(close, window):
+    """
+    Media móvil simple.
+    """
+    result = np.full(len(close), np.nan)
+    if len(close) >= window:
+        csum = np.cumsum(np.insert(close, 0, 0.0))
+        result[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return result
+
+def update_sma_state(symbol, ts, close):
+    """
+    Actualizar en O(1) por vela las sumas de las medias móviles del símbolo con las velas cerradas nuevas.
+    La última vela (en curso) no se guarda en el estado.
+    """
+    closed_ts, closed = ts[:-1], close[:-1]
+    if not len(closed_ts):  # Símbolo recién listado: aún no hay velas cerradas (medias NaN)
+        return {'buffer': deque(maxlen=SMA_LONG), 'sum_short': 0.0, 'sum_long': 0.0, 'last_ts': None}
+    state = sma_state.get(symbol)
+    if state is None or state['last_ts'] < closed_ts[0]:  # Sin estado o con huecos: reconstruir
+        buffer = deque(closed[-SMA_LONG:].tolist(), maxlen=SMA_LONG)
+        state = {
+            'buffer': buffer,
+            'sum_short': sum(list(buffer)[-SMA_SHORT:]),
+            'sum_long': sum(buffer),
+            'last_ts': closed_ts[-1],
+        }
+        sma_state[symbol] = state
+        return state
+
+    buffer = state['buffer']
+    for x in closed[closed_ts > state['last_ts']].tolist():
+        if len(buffer) >= SMA_SHORT:
+            state['sum_short'] -= buffer[-SMA_SHORT]
+        if len(buffer) == SMA_LONG:
+            state['sum_long'] -= buffer[0]
+        buffer.append(x)
+        state['sum_short'] += x
+        state['sum_long'] += x
+    state['last_ts'] = closed_ts[-1]
+    return state
+
+def _window_means(total, buffer, window, live_price):
+    """
+    Media de la ventana en la última vela cerrada y en la vela en curso.
+    """
+    closed_mean = total / window if len(buffer) >= window else np.nan
+    if len(buffer) + 1 < window:
+        return closed_mean, np.nan
+    dropped = buffer[-window] if len(buffer) >= window else 0.0
+    return closed_mean, (total - dropped + live_price) / window
+
+def live_sma(symbol, data):
+    """
+    Calcular las medias móviles de las dos últimas velas a partir del estado incremental.
+    """
+    state = update_sma_state(symbol, data['ts'], data['close'])
+    live_price = data['close'][-1]
+    short = _window_means(state['sum_short'], state['buffer'], SMA_SHORT, live_price)
+    long = _window_means(state['sum_long'], state['buffer'], SMA_LONG, live_price)
+    return np.array(short), np.array(long)
+
+@njit(cache=True)
+def _rsi_value(up, down):
+    """
+    RSI a partir de las medias de subidas y bajadas (NaN si el precio no se ha movido).
+    """
+    if down == 0:
+        return 100.0 if up > 0 else np.nan
+    return 100 - 100 / (1 + up / down)
+
+@njit('float64[:](float64[:], int64)', cache=True)
+def _rsi_series(close, window):
+    """
+    RSI de Wilder de cada vela, ignorando los NaN iniciales (símbolos con menos velas, ver stack_closes).
+    Lo usan tanto rsi (backtests) como batch_signals (en vivo).
     """
-    Aplicar una estrategia combinada de SMA, RSI y Bandas de Bollinger.
+    n = len(close)
+    gains = np.full(n, np.nan)
+    losses = np.full(n, np.nan)
+    for i in range(1, n):
+        delta = close[i] - close[i - 1]
+        if not np.isnan(delta):
+            gains[i] = max(delta, 0.0)
+            losses[i] = max(-delta, 0.0)
+    up = _wilder_smooth(gains, window, window)
+    down = _wilder_smooth(losses, window, window)
+    out = np.empty(n)
+    for i in range(n):
+        out[i] = _rsi_value(up[i], down[i])
+    return out
+
+@njit('Tuple((float64[:], float64[:]))(float64[:], int64, float64)', cache=True)
+def _bollinger_series(close, window, window_dev):
+    """
+    Bandas de Bollinger (superior, inferior) de cada vela, con la desviación típica poblacional.
+    Lo usan tanto bollinger_bands (backtests) como batch_signals (en vivo).
+    """
+    n = len(close)
+    upper = np.full(n, np.nan)
+    lower = np.full(n, np.nan)
+    for i in range(window - 1, n):
+        values = close[i - window + 1:i + 1]
+        mean = values.mean()
+        std = values.std()
+        upper[i] = mean + window_dev * std
+        lower[i] = mean - window_dev * std
+    return upper, lower
+
+def rsi(close, window=14):
+    """
+    Índice de fuerza relativa con el suavizado de Wilder.
+    """
+    return _rsi_series(close, window)
+
+def bollinger_bands(close, window=20, window_dev=2):
     """
-    sma_short = SMAIndicator(close=data['close'], window=SMA_SHORT).sma_indicator()
-    sma_long = SMAIndicator(close=data['close'], window=SMA_LONG).sma_indicator()
-    rsi = RSIIndicator(close=data['close'], window=14).rsi()
-    bb = BollingerBands(close=data['close'], window=20, window_dev=2)
+    Bandas de Bollinger (superior, inferior).
+    """
+    return _bollinger_series(close, window, float(window_dev))
 
-    data['SMA_short'] = sma_short
-    data['SMA_long'] = sma_long
-    data['RSI'] = rsi
-    data['bb_upper'] = bb.bollinger_hband()
-    data['bb_lower'] = bb.bollinger_lband()
-    data['position'] = 0
+def average_true_range(high, low, close, window=14):
+    """
+    Rango verdadero medio (ATR) con el suavizado de Wilder.
+    """
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    return _wilder_smooth(true_range, window, 1)
+
+@njit(cache=True)
+def _signal(sma_short, sma_long, rsi, buy_threshold, sell_threshold):
+    """
+    Señal de una vela: 1 comprar, -1 vender, 0 nada.
+    """
+    if sma_short > sma_long and rsi < buy_threshold:
+        return 1
+    if sma_short < sma_long and rsi > sell_threshold:
+        return -1
+    return 0
+
+@njit('int8[:](float64[:], float64[:], float64[:], float64, float64)', cache=True)
+def compute_signals(sma_short, sma_long, rsi, buy_threshold, sell_threshold):
+    """
+    Calcular la señal (1 comprar, -1 vender, 0 nada) de cada vela.
+    """
+    n = len(sma_short)
+    signal = np.zeros(n, dtype=np.int8)
+    for i in range(n):
+        signal[i] = _signal(sma_short[i], sma_long[i], rsi[i], buy_threshold, sell_threshold)
+    return signal
+
+@njit('Tuple((int8[:], float64[:], float64[:]))(float64[:, :], float64[:, :], float64[:, :], float64, float64, '
+      'int64, int64, float64)', parallel=True, cache=True)
+def batch_signals(closes, sma_short, sma_long, buy_threshold, sell_threshold, rsi_window, bb_window, bb_dev):
+    """
+    Evaluar en paralelo la estrategia en la última vela de cada símbolo.
+    `closes` son los cierres apilados (símbolos x velas, ver stack_closes) y `sma_short`/`sma_long`
+    las medias móviles de las dos últimas velas de cada símbolo (ver live_sma).
+    Devuelve el cambio de posición y las Bandas de Bollinger (superior, inferior) de la última vela.
+    """
+    n_symbols, n_bars = closes.shape
+    position = np.zeros(n_symbols, dtype=np.int8)
+    bb_upper = np.full(n_symbols, np.nan)
+    bb_lower = np.full(n_symbols, np.nan)
+    for i in prange(n_symbols):
+        row = closes[i]
+
+        # RSI de las dos últimas velas, con el mismo cálculo que rsi
+        rsi_values = np.full(2, np.nan)
+        rsi_row = _rsi_series(row, rsi_window)
+        for k in range(min(2, n_bars)):
+            rsi_values[1 - k] = rsi_row[n_bars - 1 - k]
+
+        # Solo se necesita el cambio de posición de la última vela: diferencia entera de las dos señales
+        signal_prev = _signal(sma_short[i, 0], sma_long[i, 0], rsi_values[0], buy_threshold, sell_threshold)
+        signal_last = _signal(sma_short[i, 1], sma_long[i, 1], rsi_values[1], buy_threshold, sell_threshold)
+        position[i] = signal_last - signal_prev
+
+        # Bandas de la última vela, con el mismo cálculo que bollinger_bands
+        if n_bars > 0:
+            upper, lower = _bollinger_series(row[max(0, n_bars - bb_window):], bb_window, bb_dev)
+            bb_upper[i] = upper[-1]
+            bb_lower[i] = lower[-1]
+    return position, bb_upper, bb_lower
+
+def apply_advanced_strategy(data):
+    """
+    Aplicar una estrategia combinada de SMA, RSI y Bandas de Bollinger sobre todo el histórico (backtests).
+    Recibe el diccionario de arrays de get_data_async y le añade los indicadores y señales.
+    En vivo solo importa la última vela y se usa batch_signals.
+    """
+    data['SMA_short'] = sma(data['close'], SMA_SHORT)
+    data['SMA_long'] = sma(data['close'], SMA_LONG)
+    data['RSI'] = rsi(data['close'], 14)
+    data['bb_upper'], data['bb_lower'] = bollinger_bands(data['close'], 20, 2)
 
     # Señal de cruce y filtro de RSI
-    data['signal'] = 0
-    data.loc[(data['SMA_short'] > data['SMA_long']) & (data['RSI'] < RSI_THRESHOLD_BUY), 'signal'] = 1  # Comprar
-    data.loc[(data['SMA_short'] < data['SMA_long']) & (data['RSI'] > RSI_THRESHOLD_SELL), 'signal'] = -1  # Vender
-    
-    data['position'] = data['signal'].diff()
+    signal = compute_signals(data['SMA_short'], data['SMA_long'], data['RSI'],
+                             float(RSI_THRESHOLD_BUY), float(RSI_THRESHOLD_SELL))
+    data['signal'] = signal
+    data['position'] = np.diff(signal, prepend=0).astype(np.int8)
     return data
 
-def calculate_trailing_stop_loss(purchase_price, current_price, data):
+def get_trailing_buffer(data):
     """
-    Calcular el trailing stop-loss usando el ATR para adaptarse a la volatilidad.
+    Margen del trailing stop-loss ajustado por el ATR para adaptarse a la volatilidad.
+    Se calcula una vez por ciclo y se guarda en los datos del símbolo.
     """
-    atr = AverageTrueRange(high=data['high'], low=data['low'], close=data['close'], window=14).average_true_range()
-    trailing_buffer = max(TRAILING_STOP_LOSS_BUFFER_BASE, atr.iloc[-1] / 100)
-    stop_loss_price = max(purchase_price * (1 - STOP_LOSS_PERCENTAGE), current_price * (1 - trailing_buffer))
-    return stop_loss_price
+    if 'trailing_buffer' not in data:
+        atr = average_true_range(data['high'], data['low'], data['close'], 14)
+        data['trailing_buffer'] = max(TRAILING_STOP_LOSS_BUFFER_BASE, atr[-1] / 100)
+    return data['trailing_buffer']
+
+@njit('float64(float64[:], int8[:], float64[:], float64[:], float64[:], float64, float64, float64, float64)',
+      cache=True)
+def _backtest_loop(close, position, bb_lower, bb_upper, atr, sl_pct, tb_base, balance, trade_amount):
+    """
+    Simular las órdenes de execute_advanced_trades vela a vela y devolver el balance final en USDT.
+    """
+    qty = 0.0
+    purchase_price = 0.0
+    for i in range(len(close)):
+        price = close[i]
+        if qty > 0:  # Stop-Loss y Trailing Stop-Loss ajustado por ATR
+            trailing_buffer = tb_base
+            if atr[i] / 100 > trailing_buffer:
+                trailing_buffer = atr[i] / 100
+            stop_loss_price = max(purchase_price * (1 - sl_pct), price * (1 - trailing_buffer))
+            if price <= stop_loss_price:
+                balance += qty * price
+                qty = 0.0
+                continue
+
+        if position[i] == 1 and qty == 0 and price < bb_lower[i] and balance >= trade_amount:
+            qty = trade_amount / price
+            balance -= trade_amount
+            purchase_price = price
+        elif position[i] == -1 and qty > 0 and price > bb_upper[i]:
+            balance += qty * price
+            qty = 0.0
+    if qty > 0:
+        balance += qty * close[-1]
+    return balance
+
+def backtest_advanced_strategy(data, initial_balance=1000, fixed_amount=FIXED_TRADE_AMOUNT):
+    """
+    Backtest de la estrategia avanzada sobre datos históricos.
+    Devuelve el balance final en USDT (las posiciones abiertas se valoran al último cierre).
+    """
+    data = apply_advanced_strategy(data)
+    atr = average_true_range(data['high'], data['low'], data['close'], 14)
+    return _backtest_loop(data['close'], data['position'], data['bb_lower'], data['bb_upper'], atr,
+                          float(STOP_LOSS_PERCENTAGE), float(TRAILING_STOP_LOSS_BUFFER_BASE),
+                          float(initial_balance), float(fixed_amount))
+
+def check_live_parity(seed=0):
+    """
+    Comprobar que el cálculo en vivo (live_sma y batch_signals) da en la última vela lo mismo que
+    apply_advanced_strategy, en series sintéticas largas, cortas, de una vela y planas apiladas con
+    relleno NaN como en stack_closes. Lanza RuntimeError si difieren.
+    """
+    rng = np.random.default_rng(seed)
+    datas = [{'ts': np.arange(n, dtype=np.int64) * DAY_MS,
+              'close': 100 * np.exp(np.cumsum(rng.normal(0, 0.05, n)))} for n in (500, 260, 120, 30, 2, 1)]
+    datas.append({'ts': np.arange(300, dtype=np.int64) * DAY_MS, 'close': np.full(300, 100.0)})
+
+    smas = []
+    for i, data in enumerate(datas):
+        symbol = f"__parity_{i}__"
+        # Primero sin las últimas velas, para comprobar también la actualización incremental
+        n_prev = max(len(data['ts']) - 5, 1)
+        live_sma(symbol, {'ts': data['ts'][:n_prev], 'close': data['close'][:n_prev]})
+        smas.append(live_sma(symbol, data))
+        sma_state.pop(symbol, None)
+    sma_short = np.array([short for short, _ in smas], dtype=np.float64).reshape(-1, 2)
+    sma_long = np.array([long for _, long in smas], dtype=np.float64).reshape(-1, 2)
+    position, bb_upper, bb_lower = batch_signals(stack_closes(datas), sma_short, sma_long,
+                                                 float(RSI_THRESHOLD_BUY), float(RSI_THRESHOLD_SELL), 14, 20, 2.0)
+
+    for i, data in enumerate(datas):
+        expected = apply_advanced_strategy(dict(data))
+        k = min(2, len(data['close']))
+        if (position[i] != expected['position'][-1]
+                or not np.allclose(sma_short[i, 2 - k:], expected['SMA_short'][-k:], equal_nan=True)
+                or not np.allclose(sma_long[i, 2 - k:], expected['SMA_long'][-k:], equal_nan=True)
+                or not np.allclose(bb_upper[i], expected['bb_upper'][-1], equal_nan=True)
+                or not np.allclose(bb_lower[i], expected['bb_lower'][-1], equal_nan=True)):
+            raise RuntimeError(f"El cálculo en vivo no coincide con apply_advanced_strategy "
+                               f"(serie de {len(data['close'])} velas)")
+
+def refresh_balances():
+    """
+    Obtener los saldos de todos los activos de la cuenta en una sola llamada a la API.
+    """
+    account = safe_api_call(client.get_account)
+    balances.clear()
+    balances.update({b['asset']: float(b['free']) for b in account['balances'] if float(b['free']) > 0})
+
+def save_position(symbol, qty, purchase_price):
+    """
+    Guardar la posición abierta del símbolo en memoria y en Redis.
+    La copia en Redis se intenta siempre, aunque la caché esté en pausa (ver handle_redis_error).
+    """
+    positions[symbol] = {'qty': qty, 'purchase_price': purchase_price, 'ts': time.time()}
+    if redis_client is None:
+        return
+    try:
+        redis_client.hset(POSITIONS_KEY, symbol, json.dumps(positions[symbol]))
+    except redis.RedisError as e:
+        handle_redis_error(f"guardando la posición de {symbol}", e)
+        logging.error(f"La posición de {symbol} no se ha guardado en Redis ({POSITIONS_KEY}).")
+
+def remove_position(symbol):
+    """
+    Eliminar la posición cerrada del símbolo de memoria y de Redis.
+    """
+    positions.pop(symbol, None)
+    if redis_client is None:
+        return
+    try:
+        redis_client.hdel(POSITIONS_KEY, symbol)
+    except redis.RedisError as e:
+        handle_redis_error(f"eliminando la posición de {symbol}", e)
+        logging.error(f"La posición cerrada de {symbol} sigue en Redis ({POSITIONS_KEY}): "
+                      f"hay que borrarla antes de reiniciar el bot.")
+
+def load_positions(symbols):
+    """
+    Recuperar las posiciones al arrancar: primero de Redis y, para los símbolos con saldo
+    que no estén guardados, con una llamada a get_my_trades por símbolo. Solo se recuperan
+    si la última operación fue una compra y el saldo se puede vender (los restos de una venta
+    o los airdrops no son posiciones).
+    """
+    stored = {}
+    if redis_client is not None:
+        try:
+            stored = redis_client.hgetall(POSITIONS_KEY)
+        except redis.RedisError as e:
+            handle_redis_error("leyendo las posiciones", e)
+    for symbol, value in stored.items():
+        positions[symbol.decode()] = json.loads(value)
+
+    for symbol in symbols:
+        current_qty = get_current_quantity(symbol)
+        if current_qty <= 0:
+            if symbol in positions:
+                remove_position(symbol)
+        elif symbol not in positions and floor_to_step(symbol, current_qty) > 0:
+            trades = safe_api_call(client.get_my_trades, symbol=symbol)
+            if trades and trades[-1]['isBuyer']:
+                save_position(symbol, current_qty, float(trades[-1]['price']))
+
+def record_order(symbol, order):
+    """
+    Actualizar el saldo local del activo y la posición con la respuesta de una orden ejecutada.
+    Los saldos se redondean a 8 decimales, como los devuelve Binance, para no acumular el error
+    de redondeo de los float; la cantidad de una venta se ajusta aparte (ver floor_to_step).
+    """
+    asset = symbol[:-4]
+    executed_qty = float(order['executedQty'])
+    if order['side'] == SIDE_BUY:
+        fills = order.get('fills', [])
+        commission = sum(float(f['commission']) for f in fills if f['commissionAsset'] == asset)
+        balances[asset] = round(balances.get(asset, 0.0) + executed_qty - commission, 8)
+        if executed_qty > 0:
+            purchase_price = float(order['cummulativeQuoteQty']) / executed_qty
+            save_position(symbol, balances[asset], purchase_price)
+    else:
+        balances[asset] = max(round(balances.get(asset, 0.0) - executed_qty, 8), 0.0)
+        remove_position(symbol)  # El bot siempre vende la posición completa
 
 def get_current_quantity(symbol):
     """
     Obtener la cantidad actual del activo en la cuenta.
     """
-    try:
-        position = safe_api_call(client.get_asset_balance, asset=symbol[:-4])
-        return float(position['free'])
-    except:
-        return 0
+    return balances.get(symbol[:-4], 0.0)
 
 def get_purchase_price(symbol):
     """
-    Obtener el precio de compra de la última operación.
+    Obtener el precio de compra de la posición abierta.
+    """
+    position = positions.get(symbol)
+    return position['purchase_price'] if position else 0
+
+def floor_to_step(symbol, qty):
+    """
+    Redondear hacia abajo la cantidad al tamaño de paso del símbolo (filtro LOT_SIZE).
     """
-    trades = safe_api_call(client.get_my_trades, symbol=symbol)
-    return float(trades[-1]['price']) if trades else 0
+    step_size = float(STEP_SIZES[symbol])
+    return round(qty - (qty % step_size), 8)
 
 def calculate_trade_qty(symbol, current_price, fixed_amount=FIXED_TRADE_AMOUNT):
     """
     Calcular la cantidad a comprar basada en un monto fijo en USD.
     """
-    trade_qty = fixed_amount / current_price
-    step_size = safe_api_call(client.get_symbol_info, symbol=symbol)['filters'][2]['stepSize']
-    trade_qty = round(trade_qty - (trade_qty % float(step_size)), 8)
-    return trade_qty
+    return floor_to_step(symbol, fixed_amount / current_price)
+
+def check_stop_losses(datas, prices):
+    """
+    Comprobar de una vez el Stop-Loss y el Trailing Stop-Loss de todas las posiciones abiertas
+    (ver positions) y vender las que lo alcancen. `prices` es el precio actual de cada símbolo.
+    Devuelve el conjunto de símbolos vendidos.
+    """
+    symbols = np.array([s for s in prices if s in datas and s in positions])
+    # Tras pagar la comisión en el activo el saldo no es múltiplo del paso: se vende la parte válida
+    qty = np.array([floor_to_step(s, get_current_quantity(s)) for s in symbols])
+    held = qty > 0
+    symbols, qty = symbols[held], qty[held]
+    if not len(symbols):
+        return set()
+
+    purchase = np.array([get_purchase_price(s) for s in symbols])
+    current_prices = np.array([prices[s] for s in symbols])
+    trailing_buffers = np.array([get_trailing_buffer(datas[s]) for s in symbols])
+    stop_loss_prices = np.maximum(purchase * (1 - STOP_LOSS_PERCENTAGE), current_prices * (1 - trailing_buffers))
+    triggers = current_prices <= stop_loss_prices
+
+    sold = set()
+    for i in np.flatnonzero(triggers):
+        symbol = str(symbols[i])
+        order = safe_api_call(client.order_market_sell, symbol=symbol, quantity=float(qty[i]))
+        record_order(symbol, order)
+        logging.info(f"Vendido {qty[i]} de {symbol} a {current_prices[i]}. Stop-Loss alcanzado.")
+        sold.add(symbol)
+    return sold
 
-def execute_advanced_trades(symbol, data):
+def execute_advanced_trades(symbol, current_price, position, bb_lower, bb_upper):
     """
-    Ejecutar órdenes de compra o venta basado en la estrategia avanzada, 
-    considerando Stop-Loss, Take-Profit y Trailing Stop-Loss ajustado por ATR.
+    Ejecutar órdenes de compra o venta basado en la estrategia avanzada.
+    El Stop-Loss y el Trailing Stop-Loss ajustado por ATR se comprueban antes en check_stop_losses.
+    `position`, `bb_lower` y `bb_upper` son los valores de la última vela (ver batch_signals).
     """
-    last_row = data.iloc[-1]
-    current_price = last_row['close']
     current_qty = get_current_quantity(symbol)
-    
-    if current_qty > 0:  # Si ya hay una posición abierta
-        purchase_price = get_purchase_price(symbol)
-        stop_loss_price = calculate_trailing_stop_loss(purchase_price, current_price, data)
-        
-        # Vender si se alcanza el stop-loss
-        if current_price <= stop_loss_price:
-            safe_api_call(client.order_market_sell, symbol=symbol, quantity=current_qty)
-            logging.info(f"Vendido {current_qty} de {symbol} a {current_price}. Stop-Loss alcanzado.")
-            return
-    
+
     # Condiciones de compra y venta con filtro de RSI y Bollinger Bands
-    if last_row['position'] == 1 and current_qty == 0 and current_price < last_row['bb_lower']:
+    if position == 1 and current_qty == 0 and current_price < bb_lower:
         trade_qty = calculate_trade_qty(symbol, current_price)
-        safe_api_call(client.order_market_buy, symbol=symbol, quantity=trade_qty)
+        order = safe_api_call(client.order_market_buy, symbol=symbol, quantity=trade_qty)
+        record_order(symbol, order)
         logging.info(f"Comprado {trade_qty} de {symbol} a {current_price}.")
     
-    elif last_row['position'] == -1 and current_qty > 0 and current_price > last_row['bb_upper']:
-        safe_api_call(client.order_market_sell, symbol=symbol, quantity=current_qty)
-        logging.info(f"Vendido {current_qty} de {symbol} a {current_price}.")
+    elif position == -1 and current_qty > 0 and current_price > bb_upper:
+        sell_qty = floor_to_step(symbol, current_qty)
+        if sell_qty <= 0:
+            return
+        order = safe_api_call(client.order_market_sell, symbol=symbol, quantity=sell_qty)
+        record_order(symbol, order)
+        logging.info(f"Vendido {sell_qty} de {symbol} a {current_price}.")
 
-def main():
+def on_miniticker(msg):
+    """
+    Guardar el último precio y el volumen de 24h de todos los símbolos (stream !miniTicker@arr).
+    """
+    if isinstance(msg, dict) and msg.get('e') == 'error':
+        logging.error(f"Error en el websocket de tickers: {msg}")
+        return
+    received = time.time()  # Hora local, la misma que usa get_fresh (no la hora del evento de Binance)
+    for ticker in msg:
+        last_prices[ticker['s']] = (float(ticker['c']), received)
+        ticker_volumes[ticker['s']] = (float(ticker['q']), received)
+
+def on_book_ticker(msg):
+    """
+    Guardar el mejor precio de compra (bid) de los símbolos con posición abierta (streams <symbol>@bookTicker).
+    """
+    if msg.get('e') == 'error':
+        logging.error(f"Error en el websocket de book ticker: {msg}")
+        return
+    ticker = msg['data']
+    best_bids[ticker['s']] = (float(ticker['b']), time.time())
+
+def get_fresh(stream, symbol, max_age=STREAM_MAX_AGE):
+    """
+    Valor recibido por websocket para el símbolo, o None si no hay o tiene más de `max_age` segundos.
+    """
+    entry = stream.get(symbol)
+    if entry is None or time.time() - entry[1] > max_age:
+        return None
+    return entry[0]
+
+def get_streamed_volumes(max_age=STREAM_MAX_AGE, warmup=STREAM_WARMUP):
+    """
+    Volúmenes de 24h recibidos por websocket, o None si el stream no está al día
+    (sin datos o sin eventos recientes, p. ej. tras perder la conexión).
+    !miniTicker@arr solo envía los símbolos que cambian, así que durante los primeros
+    `warmup` segundos faltan símbolos y también se devuelve None.
+    """
+    if miniticker_started is None or time.time() - miniticker_started < warmup:
+        return None
+    entries = list(ticker_volumes.items())
+    if not entries or time.time() - max(t for _, (_, t) in entries) > max_age:
+        return None
+    return {symbol: volume for symbol, (volume, _) in entries}
+
+def get_live_price(symbol):
+    """
+    Precio actual del símbolo: mejor bid o último precio por websocket si están al día y,
+    si no, el último precio por REST.
+    """
+    price = get_fresh(best_bids, symbol)
+    if price is None:
+        price = get_fresh(last_prices, symbol)
+    if price is None:
+        price = float(safe_api_call(client.get_symbol_ticker, symbol=symbol)['price'])
+    return price
+
+def on_kline(msg):
+    """
+    Registrar los símbolos cuya vela diaria se ha cerrado (streams <symbol>@kline_1d).
+    """
+    if msg.get('e') == 'error':
+        logging.error(f"Error en el websocket de velas: {msg}")
+        return
+    kline = msg['data']['k']
+    if kline['x']:
+        closed_klines.put(kline['s'])
+
+def subscribe_klines(twm, symbols, socket_name=None):
+    """
+    Suscribirse a las velas diarias de los símbolos, sustituyendo la suscripción anterior.
+    """
+    if socket_name:
+        twm.stop_socket(socket_name)
+    if not symbols:
+        return None
+    streams = [f"{s.lower()}@kline_1d" for s in symbols]
+    return twm.start_multiplex_socket(callback=on_kline, streams=streams)
+
+def subscribe_book_tickers(twm, symbols, socket_name=None):
+    """
+    Suscribirse al mejor bid de los símbolos con posición abierta, sustituyendo la suscripción anterior.
+    Binance ya no publica el stream !bookTicker de todos los símbolos.
+    """
+    if socket_name:
+        twm.stop_socket(socket_name)
+    for symbol in list(best_bids):
+        if symbol not in symbols:
+            best_bids.pop(symbol, None)  # Evitar usar bids antiguos de símbolos sin suscripción
+    if not symbols:
+        return None
+    streams = [f"{s.lower()}@bookTicker" for s in symbols]
+    return twm.start_multiplex_socket(callback=on_book_ticker, streams=streams)
+
+async def watch_stop_losses(filtered, timeout=CYCLE_INTERVAL):
+    """
+    Comprobar el stop-loss de las posiciones abiertas con los precios recibidos por websocket
+    hasta que se cierre una vela diaria o pase `timeout` segundos.
+    Las velas cerradas se cachean por día UTC (ver klines_cache_key), así que tras el cierre
+    el ciclo siguiente descarga de nuevo los datos de todos los símbolos.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        await asyncio.sleep(STOP_LOSS_CHECK_INTERVAL)
+
+        new_bar = False
+        while not closed_klines.empty():
+            closed_klines.get_nowait()
+            new_bar = True
+        if new_bar:
+            return
+
+        held = [s for s in filtered if s in positions]
+        check_stop_losses(filtered, {s: get_live_price(s) for s in held})
+
+async def main():
     """
     Ejecutar la estrategia en un ciclo continuo.
+    Entre ciclos se vigila el stop-loss con los precios en streaming y se inicia un ciclo
+    nuevo en cuanto cierra una vela diaria.
     """
-    while True:
-        symbols = get_symbols()
-        symbols = filter_symbols_by_volume(symbols)
-        symbols = filter_symbols_by_volatility(symbols)
+    global miniticker_started
+    check_live_parity()
+    async_client = await AsyncClient.create(api_key, api_secret)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    twm = ThreadedWebsocketManager(api_key=api_key, api_secret=api_secret)
+    twm.start()
+    twm.start_miniticker_socket(callback=on_miniticker)
+    miniticker_started = time.time()
+    kline_socket, kline_symbols = None, set()
+    book_ticker_socket, book_ticker_symbols = None, set()
+    refresh_step_sizes()
+    refresh_balances()
+    load_positions(get_symbols())
+    try:
+        while True:
+            refresh_step_sizes()
+            all_symbols = get_symbols()
+            # Las posiciones abiertas por el bot se analizan siempre, aunque no pasen los filtros
+            # (no el resto de saldos: BNB para comisiones, restos de ventas, airdrops...)
+            held = [s for s in all_symbols if s in positions]
+            symbols = filter_symbols_by_volume(all_symbols, volumes=get_streamed_volumes())
+            symbols += [s for s in held if s not in symbols]
+            filtered, closes = await filter_and_fetch(async_client, symbols, semaphore, keep_symbols=held)
+
+            if set(filtered) != kline_symbols:
+                kline_socket = subscribe_klines(twm, list(filtered), kline_socket)
+                kline_symbols = set(filtered)
+
+            smas = [live_sma(symbol, data) for symbol, data in filtered.items()]
+            sma_short = np.array([short for short, _ in smas], dtype=np.float64).reshape(-1, 2)
+            sma_long = np.array([long for _, long in smas], dtype=np.float64).reshape(-1, 2)
+            last_positions, bb_upper, bb_lower = batch_signals(closes, sma_short, sma_long,
+                                                               float(RSI_THRESHOLD_BUY), float(RSI_THRESHOLD_SELL),
+                                                               14, 20, 2.0)
+
+            # Precio actual: el último recibido por websocket si está al día o, si no, el de la vela en curso
+            prices = {}
+            for s, data in filtered.items():
+                price = get_fresh(last_prices, s)
+                prices[s] = price if price is not None else data['close'][-1]
+            sold = check_stop_losses(filtered, prices)
+            for i, symbol in enumerate(filtered):
+                if symbol not in sold:
+                    execute_advanced_trades(symbol, prices[symbol], last_positions[i], bb_lower[i], bb_upper[i])
 
-        for symbol in symbols:
-            data = get_data(symbol)
-            data = apply_advanced_strategy(data)
-            execute_advanced_trades(symbol, data)
+            held = {s for s in filtered if s in positions}
+            if held != book_ticker_symbols:
+                book_ticker_socket = subscribe_book_tickers(twm, sorted(held), book_ticker_socket)
+                book_ticker_symbols = held
 
-        # Esperar 4 horas antes de la próxima ejecución
-        time.sleep(14400)
+            await watch_stop_losses(filtered)
+            refresh_balances()  # Saldos del ciclo siguiente (los del primero se leen al arrancar)
+    finally:
+        twm.stop()
+        await async_client.close_connection()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())